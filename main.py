@@ -1,13 +1,36 @@
 from fastapi import FastAPI, Query
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import requests
-import pandas as pd
+from contextlib import asynccontextmanager
+from collections import OrderedDict
+from operator import itemgetter
+import aiohttp
+import asyncio
+import csv
 import io
+import orjson
 import time
-import random
+from urllib.parse import quote, urlencode
+from yarl import URL
 
-app = FastAPI(title="OpenAlex Book Scraper API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # ✅ One pooled session for the whole process, so TCP/TLS connections are reused across requests
+    # aiohttp negotiates Accept-Encoding itself (gzip/deflate, plus br when Brotli is installed)
+    app.state.session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300),
+        headers={"Accept": "application/json"},
+    )
+    # Created here rather than at import so its lock and rate state belong to this event loop
+    app.state.rate_limiter = AdaptiveTokenBucket()
+    try:
+        yield
+    finally:
+        await app.state.session.close()
+
+
+app = FastAPI(title="OpenAlex Book Scraper API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # ✅ Enable CORS
 app.add_middleware(
@@ -19,6 +42,84 @@ app.add_middleware(
 )
 
 OPENALEX_BASE = "https://api.openalex.org"
+MAX_PER_PAGE = 200  # OpenAlex maximum; pages are sized to max_results up to this
+# Only the work fields this scraper reads, to keep /works payloads small
+WORKS_SELECT = "id,display_name,publication_year,primary_location,ids,authorships,language"
+# Rows are plain tuples in this column order; dicts are only built for JSON output
+ROW_FIELDS = ("Title", "Authors", "Year", "URL", "Subject")
+CSV_CHUNK_ROWS = 500
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+THROTTLE_STATUSES = frozenset({429, 503})
+RETRY_BACKOFF_FACTOR = 0.5  # seconds; doubled per attempt for gateway/connection errors
+MAX_RETRY_AFTER = 60  # seconds; longer Retry-After requests fail instead of pausing every caller
+SUBJECT_CACHE_SIZE = 2048
+SUBJECT_CACHE_TTL = 86400  # seconds; re-resolve subject IDs daily
+SUBJECT_MISS_TTL = 300  # seconds; subjects with no match are retried sooner
+
+# subject (normalized) -> (expires_at, (key, id_url)), kept in LRU order
+subject_id_cache = OrderedDict()
+# subject (normalized) -> in-flight lookup task, shared by concurrent misses
+subject_id_lookups = {}
+
+
+class AdaptiveTokenBucket:
+    """Client-side rate limiter shared by every OpenAlex call.
+
+    The refill rate grows additively on success and shrinks multiplicatively
+    on throttling or gateway errors, so concurrent subject fetches slow down
+    together instead of each retrying on its own.
+    """
+
+    def __init__(self, rate=8.0, capacity=16, min_rate=1.0, max_rate=10.0, increase=0.1, decrease=0.5):
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.resume_at = 0.0
+        self.last_decrease = float("-inf")
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # Waiters queue on the lock, so tokens are handed out in arrival order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.resume_at:
+                    await asyncio.sleep(self.resume_at - now)
+                    continue
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def increase_rate(self):
+        self._refill()
+        self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def decrease_rate(self):
+        # Failures within one refill interval of the last cut are the same congestion event
+        now = time.monotonic()
+        if now - self.last_decrease < 1 / self.rate:
+            return
+        self.last_decrease = now
+        self._refill()
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        # Drop any banked burst so the next call waits for a fresh token
+        self.tokens = min(self.tokens, 0.0)
+
+    def pause(self, seconds):
+        """Hold back every caller for `seconds`, e.g. when the server sends Retry-After."""
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
 
 
 @app.get("/")
@@ -44,49 +145,108 @@ def pick_best_url(work: dict) -> str:
     return work.get("id", "")
 
 
-def resolve_subject_id(subject: str, session: requests.Session, mailto: str = None):
+async def resolve_subject_id(subject: str, session: aiohttp.ClientSession, rate_limiter: AdaptiveTokenBucket, base_params: dict = None):
+    """Resolve subject to an OpenAlex concept or topic ID, served from an in-memory LRU cache when possible."""
+    cache_key = subject.lower().strip()
+    cached = subject_id_cache.get(cache_key)
+    if cached and cached[0] > time.monotonic():
+        subject_id_cache.move_to_end(cache_key)
+        return cached[1]
+
+    # ✅ Concurrent misses on the same subject wait on a single lookup
+    task = subject_id_lookups.get(cache_key)
+    if task is None:
+        task = asyncio.create_task(fetch_and_cache_subject_id(cache_key, subject, session, rate_limiter, base_params))
+        subject_id_lookups[cache_key] = task
+    # Shielded so one cancelled caller doesn't cancel the lookup for the others
+    return await asyncio.shield(task)
+
+
+async def fetch_and_cache_subject_id(cache_key: str, subject: str, session: aiohttp.ClientSession, rate_limiter: AdaptiveTokenBucket, base_params: dict = None):
+    try:
+        resolved = await fetch_subject_id(subject, session, rate_limiter, base_params)
+    finally:
+        subject_id_lookups.pop(cache_key, None)
+
+    ttl = SUBJECT_CACHE_TTL if resolved[0] else SUBJECT_MISS_TTL
+    subject_id_cache[cache_key] = (time.monotonic() + ttl, resolved)
+    subject_id_cache.move_to_end(cache_key)
+    if len(subject_id_cache) > SUBJECT_CACHE_SIZE:
+        subject_id_cache.popitem(last=False)
+    return resolved
+
+
+async def fetch_subject_id(subject: str, session: aiohttp.ClientSession, rate_limiter: AdaptiveTokenBucket, base_params: dict = None):
     """Resolve subject to an OpenAlex concept or topic ID (prefer concepts)."""
-    params = {"search": subject, "per-page": 1}
-    if mailto:
-        params["mailto"] = mailto
-
-    # ✅ Try concepts first (broader)
-    r = session.get(f"{OPENALEX_BASE}/concepts", params=params, timeout=30)
-    r.raise_for_status()
-    data = r.json()
-    if data.get("results"):
-        return "concepts.id", data["results"][0]["id"]
-
-    # Then fallback to topics (narrower)
-    r = session.get(f"{OPENALEX_BASE}/topics", params=params, timeout=30)
-    r.raise_for_status()
-    data = r.json()
-    if data.get("results"):
-        return "topics.id", data["results"][0]["id"]
+    params = {**(base_params or {}), "search": subject, "per-page": 1}
+
+    async def lookup(entity):
+        data = await request_with_backoff(session, rate_limiter, f"{OPENALEX_BASE}/{entity}", params, timeout=30)
+        results = data.get("results")
+        return results[0]["id"] if results else None
+
+    # ✅ Look up concepts (broader) and topics (narrower) in parallel, preferring concepts
+    concept_id, topic_id = await asyncio.gather(lookup("concepts"), lookup("topics"))
+    if concept_id:
+        return "concepts.id", concept_id
+    if topic_id:
+        return "topics.id", topic_id
 
     return None, None
 
 
-def request_with_backoff(session, url, params, max_retries=5):
-    """Handles 429 errors with exponential backoff."""
+def retry_after_seconds(resp):
+    """Seconds requested by a Retry-After header, or None if absent/unparseable."""
+    try:
+        return max(0.0, float(resp.headers["Retry-After"]))
+    except (KeyError, ValueError):
+        return None
+
+
+async def request_with_backoff(session, rate_limiter, url, params=None, max_retries=5, timeout=60):
+    """Rate-limited GET that retries throttling, gateway and connection errors. Returns the decoded JSON body.
+
+    Every failed attempt lowers the shared token bucket's rate. Throttling
+    (429/503) waits on the bucket, and a Retry-After header of up to
+    MAX_RETRY_AFTER seconds pauses all callers; a longer one fails the request
+    instead. Gateway and connection errors also back off exponentially per
+    attempt.
+    """
     for attempt in range(max_retries):
-        resp = session.get(url, params=params, timeout=60)
-        if resp.status_code == 429:
-            sleep_time = 2 ** attempt + random.random()
-            time.sleep(sleep_time)
-            continue
-        resp.raise_for_status()
-        return resp
+        await rate_limiter.acquire()
+        try:
+            async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                if resp.status not in RETRY_STATUSES:
+                    resp.raise_for_status()
+                    rate_limiter.increase_rate()
+                    return orjson.loads(await resp.read())
+                rate_limiter.decrease_rate()
+                if resp.status in THROTTLE_STATUSES:
+                    retry_after = retry_after_seconds(resp)
+                    if retry_after is not None:
+                        # Don't hold back every caller for a wait we won't use or can't afford
+                        if retry_after > MAX_RETRY_AFTER or attempt == max_retries - 1:
+                            resp.raise_for_status()
+                        rate_limiter.pause(retry_after)
+                    continue
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == max_retries - 1:
+                raise
+            rate_limiter.decrease_rate()
+        # Sleep after the response is released so the connection goes back to the pool
+        if attempt < max_retries - 1:
+            await asyncio.sleep(RETRY_BACKOFF_FACTOR * 2 ** attempt)
     resp.raise_for_status()
 
 
-def search_books_by_subject(subject, start_year=2021, end_year=2025, max_results=50, mailto=None, oa_only=True):
-    session = requests.Session()
-    session.headers.update({"Accept": "application/json"})
+async def search_books_by_subject(subject, session, rate_limiter, start_year=2021, end_year=2025, max_results=50, base_params=None, oa_only=True):
+    """Return matching rows keyed by OpenAlex work ID, so callers can de-duplicate in O(1)."""
+    if max_results <= 0:
+        return {}
 
-    key, id_url = resolve_subject_id(subject, session, mailto)
+    key, id_url = await resolve_subject_id(subject, session, rate_limiter, base_params)
     if not key:
-        return []
+        return {}
 
     # Build filter
     filter_parts = [f"type:book", f"{key}:{id_url}", f"publication_year:{start_year}-{end_year}"]
@@ -94,22 +254,22 @@ def search_books_by_subject(subject, start_year=2021, end_year=2025, max_results
         filter_parts.append("is_oa:true")
 
     params = {
+        **(base_params or {}),
         "filter": ",".join(filter_parts),
-        "per-page": 50,
+        "per-page": min(max_results, MAX_PER_PAGE),
+        "select": WORKS_SELECT,
     }
-    if mailto:
-        params["mailto"] = mailto
-
-    all_rows, page = [], 1
-    while len(all_rows) < max_results:
-        params["page"] = page
-        print("🔍 Querying:", f"{OPENALEX_BASE}/works", params)  # ✅ Debug query
-        resp = request_with_backoff(session, f"{OPENALEX_BASE}/works", params=params)
-        results = resp.json().get("results", [])
-        if not results:
-            break
-
-        for work in results:
+
+    # ✅ Encode the static query once; each page only appends its cursor
+    works_url = f"{OPENALEX_BASE}/works?{urlencode(params)}"
+
+    # ✅ Cursor pagination: constant cost per page and no 10,000-result offset cap
+    all_rows, cursor = {}, "*"
+    while cursor:
+        page_url = URL(f"{works_url}&cursor={quote(cursor, safe='')}", encoded=True)
+        print("🔍 Querying:", page_url)  # ✅ Debug query
+        data = await request_with_backoff(session, rate_limiter, page_url)
+        for work in data.get("results", []):
             # ✅ Only English
             if work.get("language") != "en":
                 continue
@@ -122,69 +282,109 @@ def search_books_by_subject(subject, start_year=2021, end_year=2025, max_results
             title = work.get("display_name") or "N/A"
             year = work.get("publication_year")
             year = int(year) if isinstance(year, int) else 0
-            authors = [
-                (a.get("author") or {}).get("display_name")
-                for a in work.get("authorships", [])
-                if (a.get("author") or {}).get("display_name")
-            ]
-            all_rows.append(
-                {
-                    "Title": title,
-                    "Authors": ", ".join(authors),
-                    "Year": year,
-                    "URL": url,
-                    "Subject": subject,
-                }
-            )
+            authors = []
+            for authorship in work.get("authorships") or ():
+                author = authorship.get("author")
+                if author:
+                    name = author.get("display_name")
+                    if name:
+                        authors.append(name)
+            all_rows[work["id"]] = (title, ", ".join(authors), year, url, subject)
             if len(all_rows) >= max_results:
-                break
-        page += 1
+                return all_rows
+        cursor = (data.get("meta") or {}).get("next_cursor")
 
     return all_rows
 
 
+async def search_subject_with_fallback(subject, session, rate_limiter, start_year, end_year, max_results, base_params, oa_only):
+    rows = await search_books_by_subject(subject, session, rate_limiter, start_year, end_year, max_results, base_params, oa_only)
+
+    # ✅ Fallback: if too few results with OA, retry without OA
+    if oa_only and len(rows) < max_results // 5:
+        print(f"⚠️ Few results for {subject} with OA filter — retrying without OA")
+        more = await search_books_by_subject(
+            subject, session, rate_limiter, start_year, end_year, max_results, base_params, oa_only=False
+        )
+        # The non-OA query is a superset, so keep only works not already found
+        for work_id, row in more.items():
+            rows.setdefault(work_id, row)
+
+    return rows
+
+
+def iter_csv(results, chunk_rows=CSV_CHUNK_ROWS):
+    """Yield the CSV as UTF-8 bytes, `chunk_rows` rows at a time, without building the whole file in memory."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+
+    def flush():
+        chunk = buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+        return chunk
+
+    writer.writerow(ROW_FIELDS)
+    yield flush()
+    for start in range(0, len(results), chunk_rows):
+        writer.writerows(results[start:start + chunk_rows])
+        yield flush()
+
+
+def render_json(results) -> bytes:
+    return orjson.dumps([dict(zip(ROW_FIELDS, row)) for row in results])
+
+
 @app.get("/books")
-def get_books(
+async def get_books(
     subjects: str = Query(..., description="Comma-separated subjects, e.g., Marketing,Chemistry"),
     start_year: int = 2021,
     end_year: int = 2025,
     max_results: int = 50,
-    mailto: str = None,
+    mailto: str = Query(None, pattern=r"^[^@\s]+@[^@\s]+$", description="Contact email for the OpenAlex polite pool"),
     oa_only: bool = Query(True, description="Require Open Access (true/false)"),
     format: str = Query("json", description="Output format: json or csv"),
 ):
     subject_list = [s.strip() for s in subjects.split(",") if s.strip()]
+    # ✅ mailto is validated by the Query pattern; pass it once as a shared base query
+    base_params = {"mailto": mailto} if mailto else {}
+
+    # ✅ Query all subjects concurrently over the shared session and rate limiter
+    session = app.state.session
+    rate_limiter = app.state.rate_limiter
+    batches = await asyncio.gather(*[
+        search_subject_with_fallback(subject, session, rate_limiter, start_year, end_year, max_results, base_params, oa_only)
+        for subject in subject_list
+    ])
+
+    # ✅ Drop works returned for more than one subject (first subject wins)
+    seen_ids = set()
     results = []
-
-    for subject in subject_list:
-        rows = search_books_by_subject(subject, start_year, end_year, max_results, mailto, oa_only)
-        results.extend(rows)
-
-        # ✅ Fallback: if too few results with OA, retry without OA
-        if oa_only and len(rows) < max_results // 5:
-            print(f"⚠️ Few results for {subject} with OA filter — retrying without OA")
-            rows = search_books_by_subject(subject, start_year, end_year, max_results, mailto, oa_only=False)
-            results.extend(rows)
+    for rows in batches:
+        for work_id, row in rows.items():
+            if work_id in seen_ids:
+                continue
+            seen_ids.add(work_id)
+            results.append(row)
 
     if not results:
-        return JSONResponse(
+        return ORJSONResponse(
             content={"message": "No results found for given subjects."},
             status_code=404
         )
 
     # ✅ Sort by Year descending
-    results.sort(key=lambda x: x["Year"], reverse=True)
+    results.sort(key=itemgetter(ROW_FIELDS.index("Year")), reverse=True)
 
     if format == "csv":
-        df = pd.DataFrame(results)
-        buf = io.StringIO()
-        df.to_csv(buf, index=False, encoding="utf-8")
-        buf.seek(0)
+        # ✅ Stream CSV chunks as they are written (sync iterators run in Starlette's threadpool)
         filename = f"books_{'_'.join(subject_list)}.csv"
         return StreamingResponse(
-            io.BytesIO(buf.getvalue().encode("utf-8")),
+            iter_csv(results),
             media_type="text/csv",
             headers={"Content-Disposition": f"attachment; filename={filename}"},
         )
 
-    return JSONResponse(content=results)
+    # ✅ Serialize in a worker thread so large responses don't stall the event loop
+    body = await asyncio.to_thread(render_json, results)
+    return Response(content=body, media_type="application/json")